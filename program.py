@@ -1,9 +1,15 @@
-from flask import Flask, request, render_template_string, send_file
+from flask import Flask, request, render_template_string, send_file, jsonify, url_for
 import google.generativeai as genai
 import os
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 import time
+import math
+import re
+import uuid
+import threading
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pyngrok import ngrok
 import subprocess
 from requests.exceptions import HTTPError
@@ -22,6 +28,60 @@ MODEL_NAME = "gemini-1.5-flash"
 # Configure Gemini API
 genai.configure(api_key=GEMINI_API_KEY)
 
+# Deadlines (seconds) for a single generate_content call and for a whole call_gemini_api request
+CALL_TIMEOUT = 30
+REQUEST_DEADLINE = 60
+
+# Hedged requests: once a call runs past the observed p95 latency, send a duplicate and use the first answer.
+# Hedges only go out while the sliding one-minute window stays under the rate limit and hedge budget.
+HEDGE_ENABLED = True
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+MODEL_RPM_LIMIT = 15
+HEDGE_BUDGET_PER_MINUTE = 3
+
+# Tiered model routing for SAS generation: simple queries start on the fast tier and
+# escalate to stronger tiers only when the generated PROC SQL fails local validation.
+MODEL_TIERS = [
+    ("fast", "gemini-1.5-flash-8b"),
+    ("standard", "gemini-1.5-flash"),
+    ("strong", "gemini-1.5-pro"),
+]
+ROUTING_COMPLEX_THRESHOLD = 2
+
+model_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="gemini")
+api_stats_lock = threading.Lock()
+api_latencies = defaultdict(lambda: deque(maxlen=200))
+api_call_times = deque()
+hedge_times = deque()
+api_stats = {"calls": 0, "hedges": 0, "hedge_wins": 0, "timeouts": 0, "deadline_exceeded": 0}
+tier_stats = {
+    tier: {"routed": 0, "calls": 0, "escalations": 0, "latencies": deque(maxlen=200)}
+    for tier, _ in MODEL_TIERS
+}
+
+# Words that make a natural language query more than a plain listing or filter
+COMPLEX_QUERY_MARKERS = {
+    "average", "avg", "mean", "median", "sum", "total", "count", "maximum", "minimum", "max", "min",
+    "group", "grouped", "each", "per", "top", "highest", "lowest", "distinct", "unique",
+}
+STRONG_QUERY_MARKERS = {
+    "join", "rank", "ranking", "percent", "percentage", "ratio", "cumulative", "running", "compare",
+    "comparison", "trend", "growth", "having", "subquery", "pivot", "difference", "versus", "vs",
+}
+
+# SAS PROC SQL words that are not column references
+SAS_SQL_KEYWORDS = {
+    "proc", "sql", "quit", "run", "select", "from", "where", "group", "by", "order", "having", "as",
+    "and", "or", "not", "in", "is", "null", "missing", "like", "between", "distinct", "case", "when",
+    "then", "else", "end", "on", "join", "inner", "left", "right", "full", "outer", "cross", "natural",
+    "union", "all", "except", "intersect", "corr", "create", "table", "view", "insert", "into",
+    "values", "update", "set", "delete", "alter", "drop", "asc", "desc", "calculated", "contains",
+    "exists", "any", "some", "eq", "ne", "gt", "lt", "ge", "le", "title", "title1", "title2",
+    "footnote", "label", "format", "informat", "length", "outobs", "inobs", "noprint", "number",
+    "feedback", "print", "work", "sas", "true", "false", "limit", "escape",
+}
+
 # SQLite database file
 DB_FILE = "metadata.db"
 
@@ -35,6 +95,31 @@ table_name = None
 explanation_cache = {}
 suggestions_cache = {}
 
+# Cache for generated SAS code: (table_name, normalized query) -> (sas_code, cached_at)
+# Kept in least-recently-used order and capped at SAS_CACHE_MAX_ENTRIES
+sas_cache = OrderedDict()
+sas_cache_lock = threading.Lock()
+SAS_CACHE_TTL = 3600
+SAS_CACHE_MAX_ENTRIES = 1000
+
+# Prewarming of hot queries from the query log
+PREWARM_INTERVAL = 300
+PREWARM_TOP_N = 5
+PREWARM_MARGIN = 600
+PREWARM_WINDOW_DAYS = 7
+# Prewarm only starts a generation while this many calls per minute are left for user traffic
+PREWARM_HEADROOM = 10
+
+# Sentinel responses returned by the Gemini helpers
+API_ERROR_MESSAGE = "Error processing request: Too many attempts or rate limit exceeded."
+CANNOT_CONVERT_MESSAGE = "Query cannot be converted to SAS PROC SQL"
+INVALID_SAS_MESSAGE = "Generated SAS PROC SQL failed validation"
+SAS_ERROR_MESSAGES = (CANNOT_CONVERT_MESSAGE, API_ERROR_MESSAGE, INVALID_SAS_MESSAGE)
+
+# Bounded worker pool for background SAS generation jobs
+JOB_WORKERS = 4
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="sas-job")
+
 def init_db():
     """Initialize SQLite database and populate with 20 tables, each with 10 columns."""
     conn = sqlite3.connect(DB_FILE)
@@ -55,6 +140,34 @@ def init_db():
             FOREIGN KEY (table_name) REFERENCES tables (table_name)
         )
     """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS query_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            query TEXT NOT NULL,
+            query_key TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            source TEXT NOT NULL,
+            latency_ms REAL NOT NULL,
+            cache_hit INTEGER NOT NULL,
+            error TEXT,
+            created_at TEXT NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_query_log_table_key ON query_log (table_name, query_key)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            query TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            status TEXT NOT NULL,
+            sas_code TEXT,
+            sas_file TEXT,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT
+        )
+    """)
 
     tables_data = [
         ("sales_data", [
@@ -331,9 +444,8 @@ HTML_TEMPLATE = """
 <body class="bg-gray-100 font-sans">
     <div class="container max-w-4xl mx-auto p-6 bg-white rounded-lg shadow-lg">
         <h1 class="text-3xl font-bold text-gray-800 mb-6">Welcome to SAS Query Generator</h1>
-        {% if not table_name %}
-        <div class="mb-6">
-            <form method="POST" action="/set_table" class="space-y-4">
+        <div id="table-select" class="mb-6{% if table_name %} hidden{% endif %}">
+            <form id="table-form" method="POST" action="/set_table" class="space-y-4">
                 <label for="table_name" class="block text-sm font-medium text-gray-700">Select Table</label>
                 <select id="table_name" name="table_name" required class="w-full p-2 border rounded-md">
                     {% for table in tables %}
@@ -343,10 +455,10 @@ HTML_TEMPLATE = """
                 <button type="submit" class="bg-green-500 text-white px-4 py-2 rounded-md hover:bg-green-600">Set Table</button>
             </form>
         </div>
-        {% else %}
+        <div id="workspace"{% if not table_name %} class="hidden"{% endif %}>
         <div class="flex justify-between items-center mb-4">
-            <p class="text-lg font-semibold text-gray-800"><strong>Selected Table:</strong> {{ table_name }}</p>
-            <form method="POST" action="/reset" class="inline">
+            <p class="text-lg font-semibold text-gray-800"><strong>Selected Table:</strong> <span id="selected-table">{{ table_name or '' }}</span></p>
+            <form id="reset-form" method="POST" action="/reset" class="inline">
                 <button type="submit" class="bg-red-500 text-white px-4 py-2 rounded-md hover:bg-red-600">Reset</button>
             </form>
         </div>
@@ -377,37 +489,34 @@ HTML_TEMPLATE = """
         </div>
         <div class="mb-6">
             <h3 class="text-xl font-semibold text-gray-800 mb-2">Suggested Questions</h3>
-            <ul class="space-y-2">
+            <ul id="suggestions" class="space-y-2">
                 {% for suggestion in suggestions %}
                 <li class="suggestion p-2 rounded-md bg-gray-100" onclick="fillQuery({{ suggestion|tojson }})">{{ suggestion }}</li>
                 {% endfor %}
             </ul>
         </div>
         <div class="mb-6">
-            <form method="POST" action="/generate_response" class="space-y-4">
+            <form id="query-form" method="POST" action="/generate_response" class="space-y-4">
                 <label for="query" class="block text-sm font-medium text-gray-700">Enter your query or type 'explain table'</label>
                 <textarea id="query" name="query" required class="w-full p-2 border rounded-md"></textarea>
+                <input type="hidden" id="query-source" name="source" value="manual">
                 <button type="submit" class="bg-green-500 text-white px-4 py-2 rounded-md hover:bg-green-600">Generate Response</button>
             </form>
         </div>
-        {% if explanation %}
-        <h2 class="text-xl font-semibold text-gray-800 mb-2">Table Explanation</h2>
-        <div class="p-4 bg-gray-50 rounded-md">{{ explanation }}</div>
-        {% endif %}
-        {% if sas_code %}
-        <h2 class="text-xl font-semibold text-gray-800 mb-2">Generated SAS PROC SQL Code</h2>
-        <pre class="p-4 bg-gray-50 rounded-md overflow-x-auto">{{ sas_code }}</pre>
-        <form method="GET" action="/download">
-            <button type="submit" class="bg-blue-500 text-white px-4 py-2 rounded-md hover:bg-blue-600">Download SAS File</button>
-        </form>
-        {% endif %}
-        {% if error %}
-        <p class="text-red-500 mt-4">{{ error }}</p>
-        {% endif %}
-        {% endif %}
-        {% if success %}
-        <p class="text-green-500 mt-4">{{ success }}</p>
-        {% endif %}
+        <div id="explanation-section"{% if not explanation %} class="hidden"{% endif %}>
+            <h2 class="text-xl font-semibold text-gray-800 mb-2">Table Explanation</h2>
+            <div id="explanation" class="p-4 bg-gray-50 rounded-md">{{ explanation or '' }}</div>
+        </div>
+        <div id="sas-section"{% if not sas_code %} class="hidden"{% endif %}>
+            <h2 class="text-xl font-semibold text-gray-800 mb-2">Generated SAS PROC SQL Code</h2>
+            <pre id="sas-code" class="p-4 bg-gray-50 rounded-md overflow-x-auto">{{ sas_code or '' }}</pre>
+            <form id="download-form" method="GET" action="/download">
+                <button type="submit" class="bg-blue-500 text-white px-4 py-2 rounded-md hover:bg-blue-600">Download SAS File</button>
+            </form>
+        </div>
+        </div>
+        <p id="error" class="text-red-500 mt-4">{{ error or '' }}</p>
+        <p id="success" class="text-green-500 mt-4">{{ success or '' }}</p>
     </div>
     <script>
         function searchColumns() {
@@ -421,6 +530,114 @@ HTML_TEMPLATE = """
 
         function fillQuery(query) {
             document.getElementById('query').value = query;
+            document.getElementById('query-source').value = 'suggestion';
+        }
+
+        function showMessage(error, success) {
+            document.getElementById('error').textContent = error || '';
+            document.getElementById('success').textContent = success || '';
+        }
+
+        function showResult(explanation, sasCode) {
+            document.getElementById('explanation').textContent = explanation || '';
+            document.getElementById('explanation-section').classList.toggle('hidden', !explanation);
+            document.getElementById('sas-code').textContent = sasCode || '';
+            document.getElementById('sas-section').classList.toggle('hidden', !sasCode);
+        }
+
+        function renderMetadata(columns) {
+            const body = document.getElementById('column-table');
+            body.replaceChildren(...columns.map((col, index) => {
+                const row = document.createElement('tr');
+                row.className = 'column-row' + (index < 5 ? ' visible' : '');
+                [col.column_name, col.type, col.description].forEach(value => {
+                    const cell = document.createElement('td');
+                    cell.className = 'border p-2';
+                    cell.textContent = value;
+                    row.appendChild(cell);
+                });
+                return row;
+            }));
+        }
+
+        function renderSuggestions(suggestions) {
+            const list = document.getElementById('suggestions');
+            list.replaceChildren(...suggestions.map(suggestion => {
+                const item = document.createElement('li');
+                item.className = 'suggestion p-2 rounded-md bg-gray-100';
+                item.textContent = suggestion;
+                item.addEventListener('click', () => fillQuery(suggestion));
+                return item;
+            }));
+        }
+
+        async function callApi(method, url, body) {
+            const options = { method: method, headers: { 'Content-Type': 'application/json' } };
+            if (body !== undefined) options.body = JSON.stringify(body);
+            const response = await fetch(url, options);
+            const data = await response.json();
+            if (!response.ok) throw new Error(data.error || 'Request failed.');
+            return data;
+        }
+
+        async function selectTable(event) {
+            event.preventDefault();
+            try {
+                const data = await callApi('POST', '/api/v1/selection', { table_name: document.getElementById('table_name').value });
+                document.getElementById('selected-table').textContent = data.table_name;
+                renderMetadata(data.columns);
+                renderSuggestions(data.suggestions);
+                showResult(null, null);
+                document.getElementById('table-select').classList.add('hidden');
+                document.getElementById('workspace').classList.remove('hidden');
+                showMessage(null, `Table '${data.table_name}' selected.`);
+            } catch (e) {
+                showMessage(e.message, null);
+            }
+        }
+
+        async function resetTable(event) {
+            event.preventDefault();
+            try {
+                await callApi('DELETE', '/api/v1/selection');
+                document.getElementById('workspace').classList.add('hidden');
+                document.getElementById('table-select').classList.remove('hidden');
+                showResult(null, null);
+                showMessage(null, 'Form reset. Please select a table.');
+            } catch (e) {
+                showMessage(e.message, null);
+            }
+        }
+
+        async function generate(event) {
+            event.preventDefault();
+            const query = document.getElementById('query').value;
+            const source = document.getElementById('query-source').value;
+            try {
+                const data = await callApi('POST', '/api/v1/generate', { query: query, source: source });
+                showResult(data.explanation, data.sas_code);
+                showMessage(null, null);
+            } catch (e) {
+                showResult(null, null);
+                showMessage(e.message, null);
+            }
+        }
+
+        async function downloadSas(event) {
+            event.preventDefault();
+            const response = await fetch('/api/v1/download');
+            if (!response.ok) {
+                const data = await response.json();
+                showMessage(data.error || 'Download failed.', null);
+                return;
+            }
+            const match = (response.headers.get('Content-Disposition') || '').match(/filename="?([^";]+)"?/);
+            const link = document.createElement('a');
+            link.href = URL.createObjectURL(await response.blob());
+            link.download = match ? match[1] : 'sas_query.sas';
+            link.click();
+            URL.revokeObjectURL(link.href);
+            showMessage(null, null);
         }
 
         document.addEventListener('DOMContentLoaded', () => {
@@ -429,6 +646,13 @@ HTML_TEMPLATE = """
                 if (index < 5) row.classList.add('visible');
             });
             document.getElementById('column-search').addEventListener('input', searchColumns);
+            document.getElementById('query').addEventListener('input', () => {
+                document.getElementById('query-source').value = 'manual';
+            });
+            document.getElementById('table-form').addEventListener('submit', selectTable);
+            document.getElementById('reset-form').addEventListener('submit', resetTable);
+            document.getElementById('query-form').addEventListener('submit', generate);
+            document.getElementById('download-form').addEventListener('submit', downloadSas);
         });
     </script>
 </body>
@@ -457,30 +681,245 @@ def get_table_metadata(table_name):
     conn.close()
     return metadata
 
-def call_gemini_api(prompt, max_attempts=3, initial_delay=1):
-    """Call Gemini API with exponential backoff for 429 errors."""
-    model = genai.GenerativeModel(MODEL_NAME)
-    
+def prune_call_windows(now):
+    """Drop calls older than one minute from the rate windows. Caller must hold api_stats_lock."""
+    for window in (api_call_times, hedge_times):
+        while window and now - window[0] > 60:
+            window.popleft()
+
+def get_calls_in_window():
+    """Return the number of Gemini calls made in the last minute."""
+    with api_stats_lock:
+        prune_call_windows(time.time())
+        return len(api_call_times)
+
+def reserve_call_slot(hedge=False):
+    """Record a Gemini call in the one-minute window; hedges are refused when they would exceed the budget."""
+    now = time.time()
+    with api_stats_lock:
+        prune_call_windows(now)
+        if hedge:
+            if len(api_call_times) >= MODEL_RPM_LIMIT or len(hedge_times) >= HEDGE_BUDGET_PER_MINUTE:
+                return False
+            hedge_times.append(now)
+            api_stats["hedges"] += 1
+        api_call_times.append(now)
+        api_stats["calls"] += 1
+    return True
+
+def get_hedge_delay(model_name):
+    """Return the observed latency percentile after which a call is hedged, or None if there are too few samples."""
+    with api_stats_lock:
+        latencies = list(api_latencies[model_name])
+    if len(latencies) < HEDGE_MIN_SAMPLES:
+        return None
+    return percentile(latencies, HEDGE_PERCENTILE)
+
+def timed_generate(model, model_name, prompt, timeout):
+    """Run one generate_content call and record its latency."""
+    start = time.time()
+    response = model.generate_content(prompt, request_options={"timeout": timeout})
+    output = response.text
+    with api_stats_lock:
+        api_latencies[model_name].append(time.time() - start)
+    return output
+
+def generate_with_hedge(model, model_name, prompt, timeout):
+    """Call generate_content with a timeout, hedging with a duplicate call once the first passes the p95 latency."""
+    start = time.time()
+    futures = [model_executor.submit(timed_generate, model, model_name, prompt, timeout)]
+    hedge_delay = get_hedge_delay(model_name) if HEDGE_ENABLED else None
+    if hedge_delay is not None and hedge_delay < timeout:
+        done, _ = wait(futures, timeout=hedge_delay)
+        if not done and reserve_call_slot(hedge=True):
+            logger.info(f"Hedging {model_name} call after {hedge_delay:.2f} seconds")
+            futures.append(model_executor.submit(timed_generate, model, model_name, prompt, timeout))
+
+    pending = set(futures)
+    last_error = None
+    while pending:
+        done, pending = wait(pending, timeout=max(0, timeout - (time.time() - start)), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            if future.exception() is None:
+                # Running calls cannot be interrupted; cancel what we can and discard the rest.
+                for other in pending:
+                    other.cancel()
+                if future is not futures[0]:
+                    with api_stats_lock:
+                        api_stats["hedge_wins"] += 1
+                return future.result()
+            last_error = future.exception()
+    if pending or last_error is None:
+        for future in pending:
+            future.cancel()
+        with api_stats_lock:
+            api_stats["timeouts"] += 1
+        raise TimeoutError(f"Gemini call timed out after {timeout:.1f} seconds")
+    raise last_error
+
+def call_gemini_api(prompt, max_attempts=3, initial_delay=1, call_timeout=CALL_TIMEOUT, deadline=REQUEST_DEADLINE,
+                    model_name=MODEL_NAME):
+    """Call Gemini API with per-call timeouts, optional hedging, exponential backoff and an overall deadline."""
+    model = genai.GenerativeModel(model_name)
+    start = time.time()
+
+    def backoff(seconds):
+        time.sleep(max(0, min(seconds, deadline - (time.time() - start))))
+
     for attempt in range(max_attempts):
+        remaining = deadline - (time.time() - start)
+        if remaining <= 0:
+            logger.error(f"Gemini API request deadline of {deadline} seconds exceeded after {attempt} attempts")
+            with api_stats_lock:
+                api_stats["deadline_exceeded"] += 1
+            break
         try:
-            response = model.generate_content(prompt)
-            output = response.text.strip()
+            reserve_call_slot()
+            output = generate_with_hedge(model, model_name, prompt, min(call_timeout, remaining)).strip()
             logger.info(f"API call successful: {output[:50]}...")
             return output
         except HTTPError as e:
             if e.response.status_code == 429:
                 retry_after = initial_delay * (2 ** attempt)
                 logger.warning(f"429 Too Many Requests. Retrying after {retry_after} seconds...")
-                time.sleep(retry_after)
+                backoff(retry_after)
                 continue
             logger.error(f"Error calling Gemini API (attempt {attempt + 1}): {e}")
             if attempt < max_attempts - 1:
-                time.sleep(initial_delay * (2 ** attempt))
+                backoff(initial_delay * (2 ** attempt))
         except Exception as e:
             logger.error(f"Error calling Gemini API (attempt {attempt + 1}): {e}")
             if attempt < max_attempts - 1:
-                time.sleep(initial_delay * (2 ** attempt))
-    return "Error processing request: Too many attempts or rate limit exceeded."
+                backoff(initial_delay * (2 ** attempt))
+    return API_ERROR_MESSAGE
+
+def classify_query_complexity(query):
+    """Classify a natural language query as 'simple' or 'complex' using local keyword heuristics."""
+    words = re.findall(r"[a-z]+", query.lower())
+    score = sum(1 for word in words if word in COMPLEX_QUERY_MARKERS)
+    score += 2 * sum(1 for word in words if word in STRONG_QUERY_MARKERS)
+    if len(words) > 25:
+        score += 1
+    return "complex" if score >= ROUTING_COMPLEX_THRESHOLD else "simple"
+
+def find_unknown_columns(sas_code, table_name, metadata):
+    """Return identifiers in SAS PROC SQL code that are neither known columns, aliases nor SQL keywords."""
+    code = re.sub(r"```\w*", " ", sas_code)
+    code = re.sub(r"/\*.*?\*/", " ", code, flags=re.S)
+    # '*' comment statements only start at a statement boundary, not on continuation lines
+    code = re.sub(r"(\A|;)\s*\*[^;]*;", r"\1", code)
+    code = re.sub(r"'(?:[^']|'')*'\w*|\"(?:[^\"]|\"\")*\"\w*", " ", code)
+
+    known = {col["column_name"].lower() for col in metadata} | SAS_SQL_KEYWORDS | {table_name.lower()}
+    known |= {name.lower() for name in re.findall(r"\bas\s+([A-Za-z_]\w*)", code, flags=re.I)}
+    known |= {name.lower() for name in re.findall(r"\b(?:create\s+table|create\s+view)\s+(?:\w+\.)?(\w+)", code, flags=re.I)}
+    known |= {
+        name.lower()
+        for name in re.findall(r"\b(?:from|join)\s+(?:\w+\.)?\w+\s+([A-Za-z_]\w*)", code, flags=re.I)
+    }
+
+    unknown = []
+    for match in re.finditer(r"(?<![\w.:&%])([A-Za-z_]\w*)(?!\w)(\s*[(.])?", code):
+        name = match.group(1).lower()
+        if match.group(2) or name in known:
+            # Function calls, librefs/qualifiers and formats are followed by '(' or '.'
+            continue
+        if name not in unknown:
+            unknown.append(name)
+    for qualified in re.findall(r"\b[A-Za-z_]\w*\.([A-Za-z_]\w*)\b(?!\s*\()", code):
+        name = qualified.lower()
+        if name not in known and name not in unknown:
+            unknown.append(name)
+    return unknown
+
+def validate_sas_query(sas_code, table_name, metadata):
+    """Check generated SAS PROC SQL locally and return a list of problems (empty if it looks valid)."""
+    if sas_code == CANNOT_CONVERT_MESSAGE:
+        return ["query could not be converted"]
+    problems = []
+    if not re.search(r"\bquit\s*;", sas_code, flags=re.I):
+        problems.append("missing QUIT;")
+    unknown = find_unknown_columns(sas_code, table_name, metadata)
+    if unknown:
+        problems.append(f"unknown columns: {', '.join(unknown)}")
+    return problems
+
+def route_sas_query(prompt, query, table_name, metadata, deadline=REQUEST_DEADLINE):
+    """Send a SAS generation prompt to the cheapest suitable model tier, escalating when validation fails.
+
+    All tiers share one request deadline; escalation stops when it runs out. Code that still fails
+    validation is never returned: the result is then INVALID_SAS_MESSAGE (or CANNOT_CONVERT_MESSAGE).
+    """
+    request_start = time.time()
+    start_tier = 0 if classify_query_complexity(query) == "simple" else 1
+    with api_stats_lock:
+        tier_stats[MODEL_TIERS[start_tier][0]]["routed"] += 1
+
+    output = API_ERROR_MESSAGE
+    for tier_index in range(start_tier, len(MODEL_TIERS)):
+        tier, model_name = MODEL_TIERS[tier_index]
+        remaining = deadline - (time.time() - request_start)
+        if remaining <= 0:
+            logger.warning(f"SAS query deadline of {deadline} seconds exceeded before {tier} tier")
+            return output
+        start = time.time()
+        tier_output = call_gemini_api(prompt, model_name=model_name, deadline=remaining)
+        with api_stats_lock:
+            tier_stats[tier]["calls"] += 1
+            tier_stats[tier]["latencies"].append(time.time() - start)
+        if tier_output == API_ERROR_MESSAGE:
+            # Report the previous tier's failure, if any, rather than a bare API error
+            return output
+
+        problems = validate_sas_query(tier_output, table_name, metadata)
+        if not problems:
+            return tier_output
+        output = CANNOT_CONVERT_MESSAGE if tier_output == CANNOT_CONVERT_MESSAGE else INVALID_SAS_MESSAGE
+        if tier_index == len(MODEL_TIERS) - 1:
+            logger.warning(f"SAS query from {tier} tier still failed validation: {'; '.join(problems)}")
+            return output
+        logger.info(f"Escalating from {tier} tier: {'; '.join(problems)}")
+        with api_stats_lock:
+            tier_stats[tier]["escalations"] += 1
+    return output
+
+def get_routing_report():
+    """Get per-tier routing counts, escalation rates and latency percentiles."""
+    report = {}
+    with api_stats_lock:
+        for tier, model_name in MODEL_TIERS:
+            stats = tier_stats[tier]
+            latencies = list(stats["latencies"])
+            report[tier] = {
+                "model": model_name,
+                "routed": stats["routed"],
+                "calls": stats["calls"],
+                "escalations": stats["escalations"],
+                "escalation_rate": stats["escalations"] / stats["calls"] if stats["calls"] else None,
+                "latency_seconds": {f"p{pct}": percentile(latencies, pct) for pct in (50, 90, 95, 99)},
+            }
+    return report
+
+def get_model_latency_report():
+    """Get per-model latency percentiles and call, hedge and timeout counters."""
+    with api_stats_lock:
+        latencies = {name: list(values) for name, values in api_latencies.items()}
+        stats = dict(api_stats)
+    stats["models"] = {
+        name: {
+            "samples": len(values),
+            "latency_seconds": {f"p{pct}": percentile(values, pct) for pct in (50, 90, 95, 99)}
+        }
+        for name, values in latencies.items()
+    }
+    return stats
+
+def is_explanation_query(query):
+    """Check whether a query asks for a table explanation rather than SAS code."""
+    query_lower = query.lower()
+    return "explain table" in query_lower or "describe table" in query_lower or "what is this table" in query_lower
 
 def explain_table(table_name):
     """Generate an explanation of the table using Gemini API, with caching."""
@@ -502,7 +941,70 @@ def explain_table(table_name):
         explanation_cache[table_name] = explanation
     return explanation
 
-def generate_sas_query(query, table_name):
+def normalize_query(query):
+    """Normalize a natural language query for cache lookups and log aggregation."""
+    return " ".join(query.lower().split())
+
+def log_query(query, table_name, source, latency_ms, cache_hit, error=None):
+    """Append a SAS generation request to the query log. Failures are logged and never raised."""
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO query_log (query, query_key, table_name, source, latency_ms, cache_hit, error, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (query, normalize_query(query), table_name, source, latency_ms, int(cache_hit), error,
+                 datetime.now().isoformat())
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.error(f"Failed to write query log entry: {e}")
+
+def get_cached_sas(cache_key):
+    """Return the (sas_code, cached_at) cache entry for a key, or None, marking it recently used."""
+    with sas_cache_lock:
+        cached = sas_cache.get(cache_key)
+        if cached:
+            sas_cache.move_to_end(cache_key)
+        return cached
+
+def evict_expired_sas():
+    """Remove expired entries from the SAS cache."""
+    now = time.time()
+    with sas_cache_lock:
+        for cache_key in [key for key, (_, cached_at) in sas_cache.items() if now - cached_at >= SAS_CACHE_TTL]:
+            del sas_cache[cache_key]
+
+def cache_sas(cache_key, sas_code):
+    """Store generated SAS code, evicting expired entries and then the least recently used ones."""
+    evict_expired_sas()
+    with sas_cache_lock:
+        sas_cache[cache_key] = (sas_code, time.time())
+        sas_cache.move_to_end(cache_key)
+        while len(sas_cache) > SAS_CACHE_MAX_ENTRIES:
+            sas_cache.popitem(last=False)
+
+def generate_sas_query(query, table_name, source="manual", refresh=False):
+    """Convert natural language query to SAS PROC SQL using Gemini API, with caching and logging."""
+    start = time.time()
+    cache_key = (table_name, normalize_query(query))
+    cached = get_cached_sas(cache_key)
+    if cached and not refresh and time.time() - cached[1] < SAS_CACHE_TTL:
+        logger.info(f"Using cached SAS code for {table_name}: {query[:50]}")
+        log_query(query, table_name, source, (time.time() - start) * 1000, True)
+        return cached[0]
+
+    sas_code = build_sas_query(query, table_name)
+    error = sas_code if sas_code in SAS_ERROR_MESSAGES else None
+    if not error:
+        cache_sas(cache_key, sas_code)
+    log_query(query, table_name, source, (time.time() - start) * 1000, False, error)
+    return sas_code
+
+def build_sas_query(query, table_name):
     """Convert natural language query to SAS PROC SQL using Gemini API."""
     metadata = get_table_metadata(table_name)
     columns_info = "\n".join([f"- {col['column_name']}: {col['type']} ({col['description']})" for col in metadata])
@@ -521,7 +1023,7 @@ def generate_sas_query(query, table_name):
 
     Query: {query}
     """
-    return call_gemini_api(prompt)
+    return route_sas_query(prompt, query, table_name, metadata)
 
 def generate_suggestions(table_name):
     """Generate 5 relevant suggested questions for the table using Gemini API."""
@@ -553,14 +1055,194 @@ def generate_suggestions(table_name):
         suggestions_cache[table_name] = suggestions
     return suggestions
 
-def save_sas_file(sas_code):
+def save_sas_file(sas_code, job_id=None):
     """Save SAS code to a file and return the filename."""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"sas_query_{timestamp}.sas"
+    filename = f"sas_query_{timestamp}_{job_id[:8]}.sas" if job_id else f"sas_query_{timestamp}.sas"
     with open(filename, "w") as f:
         f.write(sas_code)
     return filename
 
+def update_job(job_id, **fields):
+    """Update columns of a persisted job."""
+    assignments = ", ".join(f"{column} = ?" for column in fields)
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    cursor.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+    conn.commit()
+    conn.close()
+
+def get_job(job_id):
+    """Get a job record from SQLite as a dict, or None if it does not exist."""
+    conn = sqlite3.connect(DB_FILE)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def claim_job(job_id):
+    """Atomically move a queued job to running; return False if another worker already claimed it."""
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE jobs SET status = 'running', started_at = ? WHERE job_id = ? AND status = 'queued'",
+        (datetime.now().isoformat(), job_id)
+    )
+    claimed = cursor.rowcount == 1
+    conn.commit()
+    conn.close()
+    return claimed
+
+def run_job(job_id):
+    """Worker entry point: generate SAS code for a queued job and store the result."""
+    if not claim_job(job_id):
+        return
+    job = get_job(job_id)
+    try:
+        sas_code = generate_sas_query(job["query"], job["table_name"], source="job")
+        if sas_code == CANNOT_CONVERT_MESSAGE:
+            update_job(job_id, status="failed", error="Query cannot be converted to SAS PROC SQL.",
+                       finished_at=datetime.now().isoformat())
+        elif sas_code == API_ERROR_MESSAGE:
+            update_job(job_id, status="failed", error="Failed to generate SAS query: API rate limit exceeded.",
+                       finished_at=datetime.now().isoformat())
+        elif sas_code == INVALID_SAS_MESSAGE:
+            update_job(job_id, status="failed", error="Generated SAS PROC SQL failed validation.",
+                       finished_at=datetime.now().isoformat())
+        else:
+            filename = save_sas_file(sas_code, job_id)
+            update_job(job_id, status="done", sas_code=sas_code, sas_file=filename,
+                       finished_at=datetime.now().isoformat())
+        logger.info(f"Job {job_id} finished")
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {e}")
+        update_job(job_id, status="failed", error=str(e), finished_at=datetime.now().isoformat())
+
+def submit_job(query, table_name):
+    """Persist a new SAS generation job and queue it on the worker pool."""
+    job_id = uuid.uuid4().hex
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO jobs (job_id, query, table_name, status, created_at) VALUES (?, ?, ?, ?, ?)",
+        (job_id, query, table_name, "queued", datetime.now().isoformat())
+    )
+    conn.commit()
+    conn.close()
+    job_executor.submit(run_job, job_id)
+    logger.info(f"Queued job {job_id} for table {table_name}")
+    return job_id
+
+def resume_jobs():
+    """Re-queue jobs left queued or running by a previous process."""
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    cursor.execute("SELECT job_id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at")
+    job_ids = [row[0] for row in cursor.fetchall()]
+    cursor.execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+    conn.commit()
+    conn.close()
+    for job_id in job_ids:
+        job_executor.submit(run_job, job_id)
+    if job_ids:
+        logger.info(f"Resumed {len(job_ids)} unfinished jobs")
+
+def percentile(values, pct):
+    """Return the nearest-rank percentile of a list of numbers, or None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(len(ordered) * pct / 100))
+    return ordered[rank - 1]
+
+def get_top_queries(limit=10, table_name=None, days=None):
+    """Get the most frequent logged queries per table, optionally over the last `days` days, excluding prewarm traffic."""
+    conn = sqlite3.connect(DB_FILE)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    sql = """
+        SELECT table_name, query_key, MAX(query) AS query, COUNT(*) AS count,
+               AVG(latency_ms) AS avg_latency_ms, SUM(cache_hit) AS cache_hits,
+               SUM(error IS NOT NULL) AS errors, MAX(created_at) AS last_seen
+        FROM query_log
+        WHERE source != 'prewarm'
+    """
+    params = []
+    if table_name:
+        sql += " AND table_name = ?"
+        params.append(table_name)
+    if days:
+        sql += " AND created_at >= ?"
+        params.append((datetime.now() - timedelta(days=days)).isoformat())
+    sql += " GROUP BY table_name, query_key ORDER BY table_name, count DESC, last_seen DESC"
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    conn.close()
+
+    top_queries = {}
+    for row in rows:
+        entries = top_queries.setdefault(row["table_name"], [])
+        if len(entries) < limit:
+            entries.append(dict(row))
+    return top_queries
+
+def get_latency_report(table_name=None):
+    """Get latency percentiles, cache-hit rate and error rate from the query log."""
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    sql = "SELECT latency_ms, cache_hit, error FROM query_log WHERE source != 'prewarm'"
+    params = []
+    if table_name:
+        sql += " AND table_name = ?"
+        params.append(table_name)
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    conn.close()
+
+    latencies = [row[0] for row in rows]
+    misses = [row[0] for row in rows if not row[1]]
+    return {
+        "table_name": table_name,
+        "count": len(rows),
+        "cache_hit_rate": sum(row[1] for row in rows) / len(rows) if rows else None,
+        "error_rate": sum(1 for row in rows if row[2]) / len(rows) if rows else None,
+        "latency_ms": {f"p{pct}": percentile(latencies, pct) for pct in (50, 90, 95, 99)},
+        "miss_latency_ms": {f"p{pct}": percentile(misses, pct) for pct in (50, 90, 95, 99)},
+    }
+
+def prewarm_hot_queries(top_n=PREWARM_TOP_N):
+    """Regenerate and cache SAS code for the hottest queries whose cache entries are missing or about to expire."""
+    refreshed = 0
+    for hot_table, entries in get_top_queries(limit=top_n, days=PREWARM_WINDOW_DAYS).items():
+        for entry in entries:
+            if entry["errors"] == entry["count"]:
+                # Queries that never succeed recently are not cached and would be regenerated every round
+                continue
+            with sas_cache_lock:
+                cached = sas_cache.get((hot_table, entry["query_key"]))
+            if cached and time.time() - cached[1] < SAS_CACHE_TTL - PREWARM_MARGIN:
+                continue
+            if get_calls_in_window() >= MODEL_RPM_LIMIT - PREWARM_HEADROOM:
+                logger.info(f"Prewarm paused after {refreshed} queries to leave rate limit for user traffic")
+                return refreshed
+            sas_code = generate_sas_query(entry["query"], hot_table, source="prewarm", refresh=True)
+            if sas_code not in SAS_ERROR_MESSAGES:
+                refreshed += 1
+    logger.info(f"Prewarmed {refreshed} hot queries")
+    return refreshed
+
+def prewarm_loop():
+    """Periodically prewarm the SAS cache in the background."""
+    while True:
+        time.sleep(PREWARM_INTERVAL)
+        try:
+            evict_expired_sas()
+            prewarm_hot_queries()
+        except Exception as e:
+            logger.error(f"Prewarm failed: {e}")
+
 def start_ngrok_with_retry(max_attempts=3, delay=5):
     """Start ngrok with retry mechanism to handle ERR_NGROK_3200."""
     for attempt in range(max_attempts):
@@ -579,7 +1261,13 @@ def index():
     global table_name
     tables = get_tables()
     try:
-        return render_template_string(HTML_TEMPLATE, table_name=table_name, tables=tables)
+        return render_template_string(
+            HTML_TEMPLATE,
+            table_name=table_name,
+            tables=tables,
+            metadata=get_table_metadata(table_name) if table_name else [],
+            suggestions=generate_suggestions(table_name) if table_name else []
+        )
     except Exception as e:
         logger.error(f"Template rendering error: {e}")
         return f"Error rendering template: {str(e)}", 500
@@ -652,10 +1340,7 @@ def generate_response():
             error="Query cannot be empty."
         )
     
-    query_lower = query.lower()
-    is_explanation = "explain table" in query_lower or "describe table" in query_lower or "what is this table" in query_lower
-    
-    if is_explanation:
+    if is_explanation_query(query):
         explanation = explain_table(table_name)
         if explanation == "Error processing request: Too many attempts or rate limit exceeded.":
             return render_template_string(
@@ -679,7 +1364,8 @@ def generate_response():
             logger.error(f"Template rendering error: {e}")
             return f"Error rendering template: {str(e)}", 500
     else:
-        sas_code = generate_sas_query(query, table_name)
+        source = "suggestion" if request.form.get("source") == "suggestion" else "manual"
+        sas_code = generate_sas_query(query, table_name, source=source)
         if sas_code == "Query cannot be converted to SAS PROC SQL":
             return render_template_string(
                 HTML_TEMPLATE,
@@ -698,6 +1384,15 @@ def generate_response():
                 suggestions=generate_suggestions(table_name),
                 error="Failed to generate SAS query: API rate limit exceeded. Please wait and try again."
             )
+        if sas_code == INVALID_SAS_MESSAGE:
+            return render_template_string(
+                HTML_TEMPLATE,
+                table_name=table_name,
+                tables=tables,
+                metadata=get_table_metadata(table_name),
+                suggestions=generate_suggestions(table_name),
+                error="Generated SAS PROC SQL failed validation. Please rephrase the query and try again."
+            )
         
         filename = save_sas_file(sas_code)
         global current_sas_file
@@ -731,6 +1426,156 @@ def download():
         )
     return send_file(current_sas_file, as_attachment=True, download_name=os.path.basename(current_sas_file))
 
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    data = request.get_json(silent=True) or request.form
+    query = (data.get("query") or "").strip()
+    job_table = (data.get("table_name") or table_name or "").strip()
+    if not query:
+        return jsonify(error="Query cannot be empty."), 400
+    if job_table not in get_tables():
+        return jsonify(error="Invalid table name. Please select a valid table."), 400
+    job_id = submit_job(query, job_table)
+    return jsonify(job_id=job_id, status="queued", status_url=url_for("job_status", job_id=job_id)), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify(error="Job not found."), 404
+    if job["status"] == "done":
+        job["download_url"] = url_for("job_download", job_id=job_id)
+    return jsonify(job)
+
+@app.route("/jobs/<job_id>/download", methods=["GET"])
+def job_download(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify(error="Job not found."), 404
+    if job["status"] != "done" or not job["sas_file"] or not os.path.exists(job["sas_file"]):
+        return jsonify(error="No SAS file available for this job.", status=job["status"]), 409
+    return send_file(job["sas_file"], as_attachment=True, download_name=os.path.basename(job["sas_file"]))
+
+def api_error(message, status):
+    """Build a JSON error response for the versioned API."""
+    return jsonify(error=message), status
+
+def api_sas_response(sas_code):
+    """Map generate_sas_query sentinels to JSON errors, or return None on success."""
+    if sas_code == CANNOT_CONVERT_MESSAGE:
+        return api_error("Query cannot be converted to SAS PROC SQL.", 422)
+    if sas_code == API_ERROR_MESSAGE:
+        return api_error("Failed to generate SAS query: API rate limit exceeded. Please wait and try again.", 503)
+    if sas_code == INVALID_SAS_MESSAGE:
+        return api_error("Generated SAS PROC SQL failed validation. Please rephrase the query and try again.", 422)
+    return None
+
+@app.route("/api/v1/tables", methods=["GET"])
+def api_tables():
+    return jsonify(tables=get_tables(), selected=table_name)
+
+@app.route("/api/v1/tables/<name>/metadata", methods=["GET"])
+def api_metadata(name):
+    if name not in get_tables():
+        return api_error("Table not found.", 404)
+    return jsonify(table_name=name, columns=[dict(col) for col in get_table_metadata(name)])
+
+@app.route("/api/v1/tables/<name>/suggestions", methods=["GET"])
+def api_suggestions(name):
+    if name not in get_tables():
+        return api_error("Table not found.", 404)
+    return jsonify(table_name=name, suggestions=generate_suggestions(name))
+
+@app.route("/api/v1/tables/<name>/explanation", methods=["GET"])
+def api_explanation(name):
+    if name not in get_tables():
+        return api_error("Table not found.", 404)
+    explanation = explain_table(name)
+    if explanation == API_ERROR_MESSAGE:
+        return api_error("Failed to generate table explanation: API rate limit exceeded. Please wait and try again.", 503)
+    return jsonify(table_name=name, explanation=explanation)
+
+@app.route("/api/v1/tables/<name>/sas", methods=["POST"])
+def api_sas(name):
+    if name not in get_tables():
+        return api_error("Table not found.", 404)
+    data = request.get_json(silent=True) or {}
+    query = (data.get("query") or "").strip()
+    if not query:
+        return api_error("Query cannot be empty.", 400)
+    source = "suggestion" if data.get("source") == "suggestion" else "api"
+    sas_code = generate_sas_query(query, name, source=source)
+    return api_sas_response(sas_code) or jsonify(table_name=name, query=query, sas_code=sas_code)
+
+@app.route("/api/v1/selection", methods=["POST"])
+def api_select_table():
+    global table_name
+    data = request.get_json(silent=True) or {}
+    name = (data.get("table_name") or "").strip()
+    if name not in get_tables():
+        return api_error("Invalid table name. Please select a valid table.", 400)
+    table_name = name
+    return jsonify(
+        table_name=table_name,
+        columns=[dict(col) for col in get_table_metadata(table_name)],
+        suggestions=generate_suggestions(table_name)
+    )
+
+@app.route("/api/v1/selection", methods=["DELETE"])
+def api_reset():
+    global table_name, current_sas_file
+    table_name = None
+    current_sas_file = None
+    return jsonify(table_name=None)
+
+@app.route("/api/v1/generate", methods=["POST"])
+def api_generate():
+    global current_sas_file
+    if not table_name:
+        return api_error("Please select a table first.", 400)
+    data = request.get_json(silent=True) or {}
+    query = (data.get("query") or "").strip()
+    if not query:
+        return api_error("Query cannot be empty.", 400)
+
+    if is_explanation_query(query):
+        return api_explanation(table_name)
+
+    source = "suggestion" if data.get("source") == "suggestion" else "manual"
+    sas_code = generate_sas_query(query, table_name, source=source)
+    error_response = api_sas_response(sas_code)
+    if error_response:
+        return error_response
+    current_sas_file = save_sas_file(sas_code)
+    return jsonify(table_name=table_name, query=query, sas_code=sas_code, download_url=url_for("api_download"))
+
+@app.route("/api/v1/download", methods=["GET"])
+def api_download():
+    if not current_sas_file or not os.path.exists(current_sas_file):
+        return api_error("No SAS file available for download.", 404)
+    return send_file(current_sas_file, as_attachment=True, download_name=os.path.basename(current_sas_file))
+
+@app.route("/reports/top_queries", methods=["GET"])
+def top_queries_report():
+    limit = request.args.get("limit", 10, type=int)
+    days = request.args.get("days", type=int)
+    return jsonify(get_top_queries(limit=limit, table_name=request.args.get("table_name"), days=days))
+
+@app.route("/reports/latency", methods=["GET"])
+def latency_report():
+    return jsonify(get_latency_report(table_name=request.args.get("table_name")))
+
+@app.route("/reports/model_latency", methods=["GET"])
+def model_latency_report():
+    return jsonify(get_model_latency_report())
+
+@app.route("/reports/routing", methods=["GET"])
+def routing_report():
+    return jsonify(get_routing_report())
+
+resume_jobs()
+threading.Thread(target=prewarm_loop, name="sas-prewarm", daemon=True).start()
+
 if __name__ == "__main__":
     try:
         subprocess.run(["wget", "https://bin.equinox.io/c/bNyj1mQVY4c/ngrok-v3-stable-linux-amd64.tgz"], check=True)
@@ -0,0 +1,79 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+METADATA = [
+    {"column_name": "sale_id"},
+    {"column_name": "product_name"},
+    {"column_name": "sale_date"},
+    {"column_name": "amount"},
+    {"column_name": "region"},
+]
+
+
+@pytest.fixture(scope="module")
+def program(tmp_path_factory):
+    """Import program.py with its SQLite database in a temporary directory."""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("db"))
+    try:
+        import program
+        yield program
+    finally:
+        os.chdir(cwd)
+
+
+def test_fenced_output_with_star_comments_is_valid(program):
+    sas_code = """```sas
+* Total sales by region;
+PROC SQL;
+    * Sum the sale amounts;
+    SELECT region, SUM(amount) AS total_amount
+    FROM sales_data
+    GROUP BY region;
+QUIT;
+```"""
+    assert program.validate_sas_query(sas_code, "sales_data", METADATA) == []
+
+
+def test_fenced_output_with_block_comments_is_valid(program):
+    sas_code = """```sas
+/* Total sales by region
+   for sales after 2023 */
+PROC SQL;
+    SELECT s.region, SUM(s.amount) AS total_amount /* aggregated amount */
+    FROM sales_data AS s
+    WHERE s.sale_date >= '01JAN2023'd
+    GROUP BY s.region;
+QUIT;
+```"""
+    assert program.validate_sas_query(sas_code, "sales_data", METADATA) == []
+
+
+def test_unknown_columns_and_missing_quit_are_reported(program):
+    sas_code = "PROC SQL; SELECT revenue, s.profit FROM sales_data s;"
+    assert program.validate_sas_query(sas_code, "sales_data", METADATA) == [
+        "missing QUIT;",
+        "unknown columns: revenue, profit",
+    ]
+
+
+def test_star_on_continuation_line_is_not_a_comment(program):
+    select_star = "PROC SQL;\nSELECT\n    *\nFROM sales_data\nWHERE revenue > 5;\nQUIT;"
+    assert program.validate_sas_query(select_star, "sales_data", METADATA) == ["unknown columns: revenue"]
+
+    wrapped_multiplication = "PROC SQL;\nSELECT region, amount\n     * 1.1 AS adj\nFROM sales_data WHERE bogus=1;\nQUIT;"
+    assert program.validate_sas_query(wrapped_multiplication, "sales_data", METADATA) == ["unknown columns: bogus"]
+
+
+def test_route_never_returns_code_that_failed_validation(program, monkeypatch):
+    invalid_sas = "PROC SQL;\nSELECT revenue FROM sales_data;\nQUIT;"
+    monkeypatch.setattr(program, "call_gemini_api", lambda prompt, **kwargs: invalid_sas)
+    assert program.route_sas_query("prompt", "list all rows", "sales_data", METADATA) == program.INVALID_SAS_MESSAGE
+
+    responses = iter([invalid_sas, program.API_ERROR_MESSAGE])
+    monkeypatch.setattr(program, "call_gemini_api", lambda prompt, **kwargs: next(responses))
+    assert program.route_sas_query("prompt", "list all rows", "sales_data", METADATA) == program.INVALID_SAS_MESSAGE